@@ -15,13 +15,17 @@ virtual cameras back onto the original equirectangular input images.
 import argparse
 import collections
 import enum
+import functools
+import io
 import os
+import queue
+import shutil
 from collections.abc import Sequence
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from pathlib import Path
-from threading import Lock
-from typing import Literal, TypeVar, cast
+from threading import Thread
+from typing import Any, Literal, TypeVar, cast
 
 import cv2
 import numpy as np
@@ -85,6 +89,13 @@ PANO_RENDER_OPTIONS: dict[PanoRenderType, PanoRenderOptions] = {
     ),
 }
 
+# Encoder options of the rendered images by file extension. Many images are
+# written per pano, so we favor encoding speed. Pillow's JPEG defaults already
+# encode fast with libjpeg-turbo and are kept.
+IMAGE_SAVE_OPTIONS: dict[str, dict[str, Any]] = {
+    ".png": {"compress_level": 1},
+}
+
 
 def create_virtual_camera(
     *,
@@ -112,13 +123,16 @@ def create_virtual_camera(
 def get_virtual_camera_rays(
     camera: pycolmap.Camera,
 ) -> npt.NDArray[np.floating]:
-    size = (camera.width, camera.height)
-    x, y = np.indices(size).astype(np.float32)
-    xy: NDArrayNx2 = np.column_stack([x.ravel(), y.ravel()])
-    # The center of the upper left most pixel has coordinate (0.5, 0.5)
-    xy += 0.5
+    width, height = camera.width, camera.height
+    # Pixels are enumerated in row-major (height, width) order. The center of
+    # the upper left most pixel has coordinate (0.5, 0.5).
+    xy = np.empty((width * height, 2), dtype=np.float32)
+    xy[:, 0] = np.tile(np.arange(width, dtype=np.float32) + 0.5, height)
+    xy[:, 1] = np.repeat(np.arange(height, dtype=np.float32) + 0.5, width)
     xy_norm: NDArrayNx2 = camera.cam_from_img(image_points=xy)
-    rays = np.concatenate([xy_norm, np.ones_like(xy_norm[:, :1])], -1)
+    rays = np.empty((width * height, 3), dtype=np.float32)
+    rays[:, :2] = xy_norm
+    rays[:, 2] = 1
     rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
     return rays
 
@@ -131,33 +145,213 @@ def spherical_img_from_cam(
         raise ValueError("Only 360° panoramas are supported.")
     if rays_in_cam.ndim != 2 or rays_in_cam.shape[1] != 3:
         raise ValueError(f"{rays_in_cam.shape=} but expected (N,3).")
-    r = rays_in_cam.T
-    yaw = np.arctan2(r[0], r[2])
-    pitch = -np.arctan2(r[1], np.linalg.norm(r[[0, 2]], axis=0))
-    u = (1 + yaw / np.pi) / 2
-    v = (1 - pitch * 2 / np.pi) / 2
-    return np.stack([u, v], -1) * image_size
+    width, height = image_size
+    x, y, z = rays_in_cam.T
+    # Compute the coordinates in place in the output buffer to avoid the
+    # temporaries of the individual steps, keeping the dtype of the rays:
+    #   yaw = arctan2(x, z), u = (1 + yaw / pi) / 2 * width
+    #   pitch = -arctan2(y, hypot(x, z)), v = (1 - pitch * 2 / pi) / 2 * height
+    xy = np.empty((len(rays_in_cam), 2), dtype=rays_in_cam.dtype)
+    u, v = xy[:, 0], xy[:, 1]
+    np.arctan2(x, z, out=u)
+    u *= width / (2 * np.pi)
+    u += width / 2
+    np.hypot(x, z, out=v)
+    np.arctan2(y, v, out=v)
+    v *= height / np.pi
+    v += height / 2
+    return xy
 
 
 def get_virtual_rotations(
     num_steps_yaw: int, pitches_deg: Sequence[float]
-) -> Sequence[npt.NDArray[np.floating]]:
-    """Get the relative rotations of the virtual cameras w.r.t. the panorama."""
+) -> npt.NDArray[np.floating]:
+    """Get the relative rotations of the virtual cameras w.r.t. the panorama
+    as a (N, 3, 3) array, ordered by pitch and then by yaw."""
     # Assuming that the panos are approximately upright.
-    cams_from_pano_r = []
+    pitches = np.asarray(pitches_deg, dtype=np.float64)
     yaws = np.linspace(0, 360, num_steps_yaw, endpoint=False)
-    for pitch_deg in pitches_deg:
-        yaw_offset = (360 / num_steps_yaw / 2) if pitch_deg > 0 else 0
-        for yaw_deg in yaws + yaw_offset:
-            cam_from_pano_r = Rotation.from_euler(
-                "XY", [-pitch_deg, -yaw_deg], degrees=True
-            ).as_matrix()
-            cams_from_pano_r.append(cam_from_pano_r)
-    return cams_from_pano_r
+    yaw_offsets = np.where(pitches > 0, 360 / num_steps_yaw / 2, 0)
+    yaws_per_pitch = yaws[None, :] + yaw_offsets[:, None]
+    pitches_per_yaw = np.broadcast_to(pitches[:, None], yaws_per_pitch.shape)
+    angles = np.stack([-pitches_per_yaw, -yaws_per_pitch], -1).reshape(-1, 2)
+    return Rotation.from_euler("XY", angles, degrees=True).as_matrix()
+
+
+def compute_virtual_camera_maps(
+    pano_size: tuple[int, int],
+    hfov_deg: float,
+    vfov_deg: float,
+    cams_from_pano_r: npt.NDArray[np.float32],
+    fixed_point: bool = True,
+) -> tuple[list[tuple[np.ndarray, np.ndarray]], list[np.ndarray]]:
+    """Compute the cv2.remap maps and the masks of the virtual cameras for the
+    float32 (N, 3, 3) cam_from_pano rotations.
+
+    With fixed_point, the maps are packed into the CV_16SC2 representation,
+    which halves their memory and lets cv2.remap use its faster integer path.
+    Otherwise, float maps are returned, e.g., as needed by cv2.cuda.remap.
+    """
+    pano_width, pano_height = pano_size
+    camera = create_virtual_camera(
+        pano_width=pano_width,
+        pano_height=pano_height,
+        hfov_deg=hfov_deg,
+        vfov_deg=vfov_deg,
+    )
+
+    rays_in_cam = get_virtual_camera_rays(camera)
+    # We assign each pano pixel to the virtual camera with the closest camera
+    # center. The viewing direction of each camera in the pano frame is the
+    # third row of its cam_from_pano rotation.
+    cam_centers_in_pano = cams_from_pano_r[:, 2, :]
+
+    maps = []
+    masks = []
+    for cam_idx, cam_from_pano_r in enumerate(cams_from_pano_r):
+        rays_in_pano = rays_in_cam @ cam_from_pano_r
+        xy_in_pano = spherical_img_from_cam(pano_size, rays_in_pano)
+        xy_in_pano = xy_in_pano.reshape(camera.height, camera.width, 2)
+        xy_in_pano -= 0.5  # COLMAP to OpenCV pixel origin.
+        x_coords, y_coords = xy_in_pano[..., 0], xy_in_pano[..., 1]
+        if fixed_point:
+            cam_maps = cv2.convertMaps(x_coords, y_coords, cv2.CV_16SC2)
+        else:
+            cam_maps = (
+                np.ascontiguousarray(x_coords),
+                np.ascontiguousarray(y_coords),
+            )
+        # We define a mask such that each pixel of the panorama has its
+        # features extracted only in a single virtual camera.
+        closest_camera = np.argmax(rays_in_pano @ cam_centers_in_pano.T, -1)
+        mask = np.where(
+            closest_camera == cam_idx, np.uint8(255), np.uint8(0)
+        ).reshape(camera.height, camera.width)
+        maps.append(cam_maps)
+        masks.append(mask)
+    return maps, masks
+
+
+@functools.lru_cache(maxsize=1)
+def compute_cached_virtual_camera_maps(
+    pano_size: tuple[int, int],
+    hfov_deg: float,
+    vfov_deg: float,
+    cams_from_pano_r_bytes: bytes,
+) -> tuple[list[tuple[np.ndarray, np.ndarray]], list[np.ndarray]]:
+    """Cached compute_virtual_camera_maps with fixed-point maps.
+
+    The rotations are given as raw float32 bytes to make them hashable. The
+    last result is kept, so that repeated PanoProcessor instantiations with the
+    same configuration are instant. The returned arrays are read-only.
+    """
+    cams_from_pano_r = np.frombuffer(
+        cams_from_pano_r_bytes, dtype=np.float32
+    ).reshape(-1, 3, 3)
+    maps, masks = compute_virtual_camera_maps(
+        pano_size, hfov_deg, vfov_deg, cams_from_pano_r
+    )
+    for cam_maps, mask in zip(maps, masks, strict=True):
+        for array in (*cam_maps, mask):
+            array.flags.writeable = False
+    return maps, masks
+
+
+def is_cuda_remap_available() -> bool:
+    """Check whether OpenCV was built with CUDA warping and finds a GPU."""
+    try:
+        return (
+            hasattr(cv2.cuda, "remap")
+            and cv2.cuda.getCudaEnabledDeviceCount() > 0
+        )
+    except (AttributeError, cv2.error):
+        return False
+
+
+def link_or_copy(src_path: Path, dst_path: Path) -> None:
+    """Hardlink dst_path to src_path, falling back to a copy if the file system
+    does not support hardlinks."""
+    dst_path.unlink(missing_ok=True)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+
+class FileWriter:
+    """Write encoded files to disk on dedicated background threads.
+
+    The rendering workers hand off the encoded bytes through a bounded queue,
+    so that encoding overlaps with the disk writes and multiple writes are in
+    flight at a time. The first write error is re-raised to the producers.
+    """
+
+    def __init__(self, num_threads: int = 4, max_queue_size: int = 64):
+        self._queue: queue.Queue[tuple[Path, bytes] | None] = queue.Queue(
+            max_queue_size
+        )
+        self._error: BaseException | None = None
+        self._threads = [
+            Thread(target=self._run, daemon=True) for _ in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> "FileWriter":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def write(self, path: Path, data: bytes) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put((path, data))
+
+    def close(self) -> None:
+        """Wait for all pending writes to finish."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        while (item := self._queue.get()) is not None:
+            # Keep draining the queue after an error to not block producers.
+            if self._error is not None:
+                continue
+            path, data = item
+            try:
+                path.write_bytes(data)
+            except BaseException as error:
+                self._error = error
+
+
+def list_file_names(root_dir: Path) -> list[str]:
+    """Recursively list the files in root_dir as sorted relative posix paths.
+
+    Uses os.scandir, whose entries cache the file type, to avoid the per-file
+    stat calls and Path objects of Path.rglob on large (networked) datasets.
+    Like Path.rglob, symlinks to directories are not followed.
+    """
+    names: list[str] = []
+    dirs = [("", os.fspath(root_dir))]
+    while dirs:
+        prefix, dir_path = dirs.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    names.append(prefix + entry.name)
+                elif not entry.is_symlink():
+                    dirs.append((f"{prefix}{entry.name}/", entry.path))
+    names.sort()
+    return names
 
 
 def create_pano_rig_config(
-    cams_from_pano_rotation: Sequence[npt.NDArray[np.floating]],
+    cams_from_pano_rotation: npt.NDArray[np.floating],
     ref_idx: int = 0,
 ) -> pycolmap.RigConfig:
     """Create a RigConfig for the given virtual rotations."""
@@ -191,6 +385,7 @@ class PanoProcessor:
         output_image_dir: Path,
         mask_dir: Path,
         render_options: PanoRenderOptions,
+        pano_size: tuple[int, int],
     ):
         self.render_options = render_options
         self.pano_image_dir = pano_image_dir
@@ -203,21 +398,87 @@ class PanoProcessor:
         )
         self.rig_config = create_pano_rig_config(self.cams_from_pano_rotation)
 
-        # We assign each pano pixel to the virtual camera
-        # with the closest camera center.
-        self.cam_centers_in_pano = np.einsum(
-            "nij,i->nj", self.cams_from_pano_rotation, [0, 0, 1]
+        # Precompute the virtual camera, the per-camera remap coordinates, and
+        # the per-camera masks, which only depend on the pano size. This is
+        # done before processing any pano image, so that the workers only read
+        # the shared state and need no synchronization.
+        pano_width, pano_height = pano_size
+        self._camera: pycolmap.Camera = create_virtual_camera(
+            pano_width=pano_width,
+            pano_height=pano_height,
+            hfov_deg=self.render_options.hfov_deg,
+            vfov_deg=self.render_options.vfov_deg,
         )
+        for rig_camera in self.rig_config.cameras:
+            rig_camera.camera = self._camera
+        self._pano_size: tuple[int, int] = (pano_width, pano_height)
+
+        # If available, remap on the GPU with the maps uploaded once.
+        self._use_cuda = is_cuda_remap_available()
+        if self._use_cuda:
+            logging.info("Rendering perspective images with CUDA.")
+        # The rendering runs in float32 like the rays, while the rig config and
+        # the conversion to equirectangular use the float64 rotations.
+        cams_from_pano_r = self.cams_from_pano_rotation.astype(np.float32)
+        self._maps: Sequence[tuple[np.ndarray, np.ndarray]] = []
+        self._cuda_maps: list[tuple[cv2.cuda.GpuMat, cv2.cuda.GpuMat]] = []
+        if self._use_cuda:
+            # The float maps are not cached, so that their host copies are
+            # released after the upload.
+            maps, masks = compute_virtual_camera_maps(
+                self._pano_size,
+                self.render_options.hfov_deg,
+                self.render_options.vfov_deg,
+                cams_from_pano_r,
+                fixed_point=False,
+            )
+            for x_coords, y_coords in maps:
+                x_coords_gpu = cv2.cuda.GpuMat()
+                x_coords_gpu.upload(x_coords)
+                y_coords_gpu = cv2.cuda.GpuMat()
+                y_coords_gpu.upload(y_coords)
+                self._cuda_maps.append((x_coords_gpu, y_coords_gpu))
+            del maps
+        else:
+            self._maps, masks = compute_cached_virtual_camera_maps(
+                self._pano_size,
+                self.render_options.hfov_deg,
+                self.render_options.vfov_deg,
+                cams_from_pano_r.tobytes(),
+            )
 
-        self._lock = Lock()
-
-        # These are initialized on the first pano image
-        # to avoid recomputing the rays for each pano image.
-        self._camera: pycolmap.Camera | None = None
-        self._pano_size: tuple[int, int] | None = None
-        self._rays_in_cam: npt.NDArray[np.floating] | None = None
-
-    def process(self, pano_name: str) -> None:
+        self._mask_paths: list[Path] = []
+        for cam_idx, mask in enumerate(masks):
+            # The masks are identical for all panos, so we write them once and
+            # hardlink them for each rendered image.
+            image_prefix = self.rig_config.cameras[cam_idx].image_prefix
+            mask_path = self.mask_dir / f"{image_prefix.rstrip('/')}.png"
+            mask_path.parent.mkdir(exist_ok=True, parents=True)
+            # Replace instead of overwriting the file in place, which would
+            # also modify the masks hardlinked to it by an earlier run.
+            mask_path.unlink(missing_ok=True)
+            # Binary masks compress well even at the fastest PNG level.
+            if not cv2.imwrite(
+                str(mask_path), mask, [cv2.IMWRITE_PNG_COMPRESSION, 1]
+            ):
+                raise RuntimeError(f"Cannot write {mask_path}")
+            self._mask_paths.append(mask_path)
+
+    def create_output_dirs(self, pano_names: Sequence[str]) -> None:
+        """Create the image and mask folders of all rendered images once,
+        instead of in process for every image."""
+        pano_subdirs = {
+            pano_name.rpartition("/")[0] for pano_name in pano_names
+        }
+        for rig_camera in self.rig_config.cameras:
+            for pano_subdir in pano_subdirs:
+                for output_dir in (self.output_image_dir, self.mask_dir):
+                    subdir = output_dir / rig_camera.image_prefix / pano_subdir
+                    subdir.mkdir(exist_ok=True, parents=True)
+
+    def process(self, pano_name: str, writer: FileWriter) -> None:
+        """Render a pano into the virtual cameras. Expects the output folders
+        to be created by create_output_dirs."""
         pano_path = self.pano_image_dir / pano_name
         try:
             pano_pil_image = PIL.Image.open(pano_path)
@@ -225,76 +486,96 @@ class PanoProcessor:
             logging.info(f"Skipping file {pano_path} as it cannot be read.")
             return
 
-        pano_exif = pano_pil_image.getexif()
-        gpsonly_exif = PIL.Image.Exif()
-        gpsonly_exif[PIL.ExifTags.IFD.GPSInfo] = pano_exif.get_ifd(
-            PIL.ExifTags.IFD.GPSInfo
-        )
+        # PIL opens the image lazily, so close it explicitly in case the pixels
+        # are decoded by OpenCV instead.
+        with pano_pil_image:
+            pano_exif = pano_pil_image.getexif()
+            gpsonly_exif = PIL.Image.Exif()
+            gpsonly_exif[PIL.ExifTags.IFD.GPSInfo] = pano_exif.get_ifd(
+                PIL.ExifTags.IFD.GPSInfo
+            )
 
-        pano_image = np.asarray(pano_pil_image)
+            # PIL only parses the header for the EXIF above, but decoding is
+            # faster with OpenCV. IMREAD_UNCHANGED keeps grayscale and alpha
+            # channels and does not apply the EXIF orientation, like PIL. Fall
+            # back to PIL for other bit depths, which PIL converts differently,
+            # and for formats OpenCV cannot read.
+            pano_image = cv2.imread(str(pano_path), cv2.IMREAD_UNCHANGED)
+            if pano_image is None or pano_image.dtype != np.uint8:
+                pano_image = np.asarray(pano_pil_image)
+            elif pano_image.ndim == 3:
+                cv2.cvtColor(
+                    pano_image,
+                    cv2.COLOR_BGRA2RGBA
+                    if pano_image.shape[2] == 4
+                    else cv2.COLOR_BGR2RGB,
+                    dst=pano_image,
+                )
         pano_height, pano_width, *_ = pano_image.shape
         if pano_width != pano_height * 2:
             raise ValueError("Only 360° panoramas are supported.")
 
-        with self._lock:
-            if self._camera is None:  # First image, precompute rays once.
-                self._camera = create_virtual_camera(
-                    pano_width=pano_width,
-                    pano_height=pano_height,
-                    hfov_deg=self.render_options.hfov_deg,
-                    vfov_deg=self.render_options.vfov_deg,
+        if (pano_width, pano_height) != self._pano_size:
+            raise ValueError("Panoramas of different sizes are not supported.")
+
+        image_format = PIL.Image.registered_extensions().get(
+            pano_path.suffix.lower()
+        )
+        save_options = IMAGE_SAVE_OPTIONS.get(pano_path.suffix.lower(), {})
+        if self._use_cuda:
+            images = self._remap_cuda(pano_image)
+        else:
+            images = [
+                cv2.remap(
+                    pano_image,
+                    map1,
+                    map2,
+                    cv2.INTER_LINEAR,
+                    borderMode=cv2.BORDER_WRAP,
                 )
-                for rig_camera in self.rig_config.cameras:
-                    rig_camera.camera = self._camera
-                self._pano_size = (pano_width, pano_height)
-                self._rays_in_cam = get_virtual_camera_rays(self._camera)
-            else:  # Later images, verify consistent panoramas.
-                if (pano_width, pano_height) != self._pano_size:
-                    raise ValueError(
-                        "Panoramas of different sizes are not supported."
-                    )
-
-        for cam_idx, cam_from_pano_r in enumerate(self.cams_from_pano_rotation):
-            assert self._rays_in_cam is not None
-            rays_in_pano = self._rays_in_cam @ cam_from_pano_r
-            xy_in_pano = spherical_img_from_cam(self._pano_size, rays_in_pano)
-            xy_in_pano = xy_in_pano.reshape(
-                self._camera.width, self._camera.height, 2
-            ).astype(np.float32)
-            xy_in_pano -= 0.5  # COLMAP to OpenCV pixel origin.
-            x_coords, y_coords = np.moveaxis(xy_in_pano, [0, 1, 2], [2, 1, 0])
-            image = cv2.remap(
-                pano_image,
-                x_coords,
-                y_coords,
-                cv2.INTER_LINEAR,
-                borderMode=cv2.BORDER_WRAP,
-            )
-            # We define a mask such that each pixel of the panorama has its
-            # features extracted only in a single virtual camera.
-            closest_camera = np.argmax(
-                rays_in_pano @ self.cam_centers_in_pano.T, -1
-            )
-            mask = (
-                ((closest_camera == cam_idx) * 255)
-                .astype(np.uint8)
-                .reshape(self._camera.width, self._camera.height)
-                .transpose()
-            )
+                for map1, map2 in self._maps
+            ]
 
+        for cam_idx, image in enumerate(images):
             image_name = (
                 self.rig_config.cameras[cam_idx].image_prefix + pano_name
             )
             mask_name = f"{image_name}.png"
 
             image_path = self.output_image_dir / image_name
-            image_path.parent.mkdir(exist_ok=True, parents=True)
-            PIL.Image.fromarray(image).save(image_path, exif=gpsonly_exif)
+            # Only encode here and leave the disk write to the writer threads.
+            image_buffer = io.BytesIO()
+            PIL.Image.fromarray(image).save(
+                image_buffer,
+                format=image_format,
+                exif=gpsonly_exif,
+                **save_options,
+            )
+            writer.write(image_path, image_buffer.getvalue())
 
             mask_path = self.mask_dir / mask_name
-            mask_path.parent.mkdir(exist_ok=True, parents=True)
-            if not pycolmap.Bitmap.from_array(mask).write(mask_path):
-                raise RuntimeError(f"Cannot write {mask_path}")
+            link_or_copy(self._mask_paths[cam_idx], mask_path)
+
+    def _remap_cuda(self, pano_image: np.ndarray) -> list[np.ndarray]:
+        """Render all virtual cameras of a pano on the GPU. Each call uses its
+        own stream, so the transfers of concurrent workers can overlap."""
+        stream = cv2.cuda.Stream()
+        pano_image_gpu = cv2.cuda.GpuMat()
+        pano_image_gpu.upload(pano_image, stream)
+        images = []
+        for x_coords_gpu, y_coords_gpu in self._cuda_maps:
+            # The opencv-python stubs lack the CUDA warping module.
+            image_gpu = cv2.cuda.remap(  # type: ignore[attr-defined]
+                pano_image_gpu,
+                x_coords_gpu,
+                y_coords_gpu,
+                cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_WRAP,
+                stream=stream,
+            )
+            images.append(image_gpu.download(stream))
+        stream.waitForCompletion()
+        return images
 
     def split_image_name(self, image_name: str) -> tuple[int, str]:
         """Split a rendered image name into (virtual camera idx, pano name)."""
@@ -317,8 +598,6 @@ class PanoProcessor:
         through the same spherical mapping used for rendering, so the result is
         a valid, bundle-adjustable reconstruction.
         """
-        if self._camera is None or self._pano_size is None:
-            raise RuntimeError("No panorama was rendered yet.")
         pano_width, pano_height = self._pano_size
 
         equirect = pycolmap.Reconstruction()
@@ -434,22 +713,49 @@ def render_perspective_images(
     mask_dir: Path,
     render_options: PanoRenderOptions,
 ) -> PanoProcessor:
+    # Read the size of the first readable pano image, so that the processor
+    # can precompute its shared state before the workers start.
+    pano_size: tuple[int, int] | None = None
+    for pano_name in pano_image_names:
+        try:
+            with PIL.Image.open(pano_image_dir / pano_name) as pano_pil_image:
+                pano_size = pano_pil_image.size
+            break
+        except PIL.Image.UnidentifiedImageError:
+            continue
+    if pano_size is None:
+        raise ValueError(f"No readable panorama found in {pano_image_dir}.")
+
     processor = PanoProcessor(
-        pano_image_dir, output_image_dir, mask_dir, render_options
+        pano_image_dir, output_image_dir, mask_dir, render_options, pano_size
     )
+    processor.create_output_dirs(pano_image_names)
 
+    # A thread pool suffices, because the per-pano work is dominated by image
+    # decoding, cv2.remap, and encoding, which all release the GIL, while the
+    # GIL-bound geometry is precomputed once by the processor. Processes would
+    # instead have to pickle the processor and duplicate its maps per worker.
     num_panos = len(pano_image_names)
-    max_workers = min(32, (os.cpu_count() or 2) - 1)
-
-    with tqdm(total=num_panos) as pbar:
-        with ThreadPoolExecutor(max_workers=max_workers) as thread_pool:
-            futures = [
-                thread_pool.submit(processor.process, pano_name)
-                for pano_name in pano_image_names
-            ]
-            for future in as_completed(futures):
-                future.result()
-                pbar.update(1)
+    num_cpus = os.cpu_count() or 2
+    max_workers = max(1, min(32, num_cpus - 1, num_panos))
+
+    # cv2.remap is internally parallelized. Split the cores among the workers
+    # to avoid oversubscription, while still using all cores when there are
+    # fewer panos than cores.
+    prev_num_cv2_threads = cv2.getNumThreads()
+    cv2.setNumThreads(max(1, num_cpus // max_workers))
+    try:
+        with tqdm(total=num_panos) as pbar, FileWriter() as writer:
+            with ThreadPoolExecutor(max_workers=max_workers) as thread_pool:
+                futures = [
+                    thread_pool.submit(processor.process, pano_name, writer)
+                    for pano_name in pano_image_names
+                ]
+                for future in as_completed(futures):
+                    future.result()
+                    pbar.update(1)
+    finally:
+        cv2.setNumThreads(prev_num_cv2_threads)
 
     return processor
 
@@ -526,11 +832,7 @@ def run_perspective(
 
     # Search for input images.
     pano_image_dir = args.input_image_path
-    pano_image_names = sorted(
-        p.relative_to(pano_image_dir).as_posix()
-        for p in pano_image_dir.rglob("*")
-        if not p.is_dir()
-    )
+    pano_image_names = list_file_names(pano_image_dir)
     logging.info(f"Found {len(pano_image_names)} images in {pano_image_dir}.")
 
     processor = render_perspective_images(
@@ -0,0 +1,77 @@
+import contextlib
+from pathlib import Path
+
+import numpy as np
+import panorama_sfm
+import pytest
+from scipy.spatial.transform import Rotation
+
+
+def test_get_virtual_rotations() -> None:
+    for options in panorama_sfm.PANO_RENDER_OPTIONS.values():
+        expected = []
+        yaws = np.linspace(0, 360, options.num_steps_yaw, endpoint=False)
+        for pitch_deg in options.pitches_deg:
+            yaw_offset = (
+                (360 / options.num_steps_yaw / 2) if pitch_deg > 0 else 0
+            )
+            for yaw_deg in yaws + yaw_offset:
+                expected.append(
+                    Rotation.from_euler(
+                        "XY", [-pitch_deg, -yaw_deg], degrees=True
+                    ).as_matrix()
+                )
+        cams_from_pano_r = panorama_sfm.get_virtual_rotations(
+            num_steps_yaw=options.num_steps_yaw,
+            pitches_deg=options.pitches_deg,
+        )
+        assert cams_from_pano_r.shape == (len(expected), 3, 3)
+        np.testing.assert_allclose(cams_from_pano_r, expected)
+
+
+def test_file_writer(tmp_path: Path) -> None:
+    with panorama_sfm.FileWriter(num_threads=2, max_queue_size=2) as writer:
+        for i in range(10):
+            writer.write(tmp_path / f"{i}.bin", bytes([i]) * 3)
+    for i in range(10):
+        assert (tmp_path / f"{i}.bin").read_bytes() == bytes([i]) * 3
+
+
+def test_file_writer_error(tmp_path: Path) -> None:
+    writer = panorama_sfm.FileWriter(num_threads=1, max_queue_size=1)
+    writer.write(tmp_path / "missing" / "0.bin", b"0")
+    # Writes after the error must not block, even with a full queue.
+    with contextlib.suppress(FileNotFoundError):
+        for i in range(1, 10):
+            writer.write(tmp_path / f"{i}.bin", b"1")
+    with pytest.raises(FileNotFoundError):
+        writer.close()
+    with pytest.raises(FileNotFoundError):
+        writer.write(tmp_path / "10.bin", b"10")
+
+
+def test_list_file_names(tmp_path: Path) -> None:
+    (tmp_path / "sub" / "subsub").mkdir(parents=True)
+    (tmp_path / "empty").mkdir()
+    for name in ["b.jpg", "a.jpg", "sub/c.jpg", "sub/subsub/d.jpg"]:
+        (tmp_path / name).write_bytes(b"")
+    try:
+        (tmp_path / "sub" / "link.jpg").symlink_to(tmp_path / "a.jpg")
+        (tmp_path / "linked_dir").symlink_to(
+            tmp_path / "sub", target_is_directory=True
+        )
+    except OSError:
+        pytest.skip("Symlinks are not supported.")
+    expected = sorted(
+        p.relative_to(tmp_path).as_posix()
+        for p in tmp_path.rglob("*")
+        if not p.is_dir()
+    )
+    assert expected == [
+        "a.jpg",
+        "b.jpg",
+        "sub/c.jpg",
+        "sub/link.jpg",
+        "sub/subsub/d.jpg",
+    ]
+    assert panorama_sfm.list_file_names(tmp_path) == expected